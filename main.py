@@ -1,10 +1,12 @@
 import asyncio
+import logging
 import os
 from src.route_generator import RouteGenerator
 from src.vessel import Vessel
 from src.database import DatabaseManager
 from src.websocket_server import WebSocketStreamer
 from src.dashboard import create_app
+from src.metrics import SamplingProfiler
 import threading
 
 
@@ -22,6 +24,8 @@ async def main():
         # "speed_factor": 1.0,
         "websocket_port": 8765,
         "flask_port": 5000,
+        # Set to a file path to write folded stacks for a flamegraph of this run
+        "profile_output": None,
     }
 
     # Ensure data directory exists
@@ -75,16 +79,27 @@ async def main():
         flask_thread.start()
         return flask_thread
 
-    # Generate tasks
-    tasks = [
-        run_simulation(gen_vessel_and_route()) for _ in range(config["num_vessels"])
-    ]
+    profiler = None
+    if config["profile_output"]:
+        profiler = SamplingProfiler(config["profile_output"])
+        profiler.start()
 
-    # Run dashboard in background
-    flask_thread = await run_dashboard()
+    try:
+        # Generate tasks
+        tasks = [
+            run_simulation(gen_vessel_and_route()) for _ in range(config["num_vessels"])
+        ]
 
-    # Run simulation tasks and exit after completion
-    await asyncio.gather(*tasks)
+        # Run dashboard in background
+        flask_thread = await run_dashboard()
+
+        # Run simulation tasks and exit after completion
+        await asyncio.gather(*tasks)
+    finally:
+        # Write the profile even if the simulation failed
+        if profiler is not None:
+            profiler.stop()
+            print(f"Profile written to {config['profile_output']}")
 
     # Keep Flask alive
     flask_thread.join()
@@ -92,4 +107,5 @@ async def main():
 
 # Entry point
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
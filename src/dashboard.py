@@ -1,5 +1,6 @@
-from flask import Flask, render_template
+from flask import Flask, Response, jsonify, render_template, request
 import os
+from src.metrics import registry
 
 
 def create_app(db_manager):
@@ -29,6 +30,13 @@ def create_app(db_manager):
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """Expose simulation metrics in Prometheus text format."""
+        return Response(
+            registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
     @app.route("/shutdown")
     def shutdown():
         os._exit(0)  # Forcefully shutdown the Flask server
@@ -8,18 +8,42 @@ from sqlalchemy import (
     Boolean,
     Index,
     UniqueConstraint,
+    func,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from pyais import decode
-import numpy as np
 from src.route_generator import RouteGenerator
+from src.metrics import INVALID_ROWS, QUERY_PLANS, stage_timer
 import random
 import os
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
 
 Base = declarative_base()
 
+HOUR = 3600
+DAY = 86400
+# Rollup resolutions in seconds, coarsest first
+ROLLUP_RESOLUTIONS = (DAY, HOUR)
+DEFAULT_TRACK_POINTS = 2000
+
+_EPOCH = datetime(1970, 1, 1)
+
+TrackPoint = namedtuple("TrackPoint", ["timestamp", "latitude", "longitude"])
+Segment = namedtuple(
+    "Segment",
+    [
+        "first_latitude",
+        "first_longitude",
+        "last_latitude",
+        "last_longitude",
+        "distance",
+        "speed_sum",
+        "point_count",
+    ],
+)
+
 
 class AISMessage(Base):
     """SQLAlchemy model for AIS messages."""
@@ -45,6 +69,94 @@ class AISMessage(Base):
     )
 
 
+class AISRollup(Base):
+    """SQLAlchemy model for per-MMSI time-bucketed aggregates of valid messages."""
+
+    __tablename__ = "ais_rollups"
+
+    id = Column(Integer, primary_key=True)
+    mmsi = Column(String, nullable=False)
+    resolution = Column(Integer, nullable=False)  # bucket width in seconds
+    bucket_start = Column(DateTime, nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    first_latitude = Column(Float, nullable=False)
+    first_longitude = Column(Float, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    last_latitude = Column(Float, nullable=False)
+    last_longitude = Column(Float, nullable=False)
+    distance = Column(Float, nullable=False)  # nautical miles within the bucket
+    speed_sum = Column(Float, nullable=False)
+    speed_min = Column(Float, nullable=False)
+    speed_max = Column(Float, nullable=False)
+    point_count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "mmsi", "resolution", "bucket_start", name="_mmsi_resolution_bucket_uc"
+        ),
+    )
+
+
+def _parse_time(value):
+    """Accept ISO strings or datetimes, normalising aware values to naive UTC."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _floor_time(value, resolution):
+    """Round a datetime down to the start of its bucket."""
+    buckets = (value - _EPOCH) // timedelta(seconds=resolution)
+    return _EPOCH + timedelta(seconds=buckets * resolution)
+
+
+def _ceil_time(value, resolution):
+    """Round a datetime up to the next bucket boundary."""
+    floored = _floor_time(value, resolution)
+    if floored < value:
+        floored += timedelta(seconds=resolution)
+    return floored
+
+
+def _plan_window(start, end, resolutions=ROLLUP_RESOLUTIONS):
+    """Split a half-open window into ordered (resolution, start, end) pieces.
+
+    Whole buckets are served from the coarsest rollup that fits, and the
+    ragged edges fall through to finer rollups and finally to raw rows
+    (resolution None), so aggregates over the plan match the raw data exactly.
+    """
+    for i, resolution in enumerate(resolutions):
+        lo = _ceil_time(start, resolution)
+        hi = _floor_time(end, resolution)
+        if lo < hi:
+            finer = resolutions[i + 1 :]
+            return (
+                _plan_window(start, lo, finer)
+                + [(resolution, lo, hi)]
+                + _plan_window(hi, end, finer)
+            )
+    return [(None, start, end)] if start < end else []
+
+
+def _track_plan(start, end, resolution):
+    """Plan a track window using rollups no coarser than resolution."""
+    return _plan_window(
+        start, end, tuple(r for r in ROLLUP_RESOLUTIONS if r <= resolution)
+    )
+
+
+def _thin_track(track, max_points):
+    """Evenly sample a track down to max_points, keeping both endpoints."""
+    if len(track) <= max_points:
+        return track
+    if max_points <= 1:
+        return track[-1:] if max_points == 1 else []
+    step = (len(track) - 1) / (max_points - 1)
+    return [track[round(i * step)] for i in range(max_points)]
+
+
 class DatabaseManager:
     """Manages SQLAlchemy database operations."""
 
@@ -58,6 +170,19 @@ class DatabaseManager:
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
 
+        # Databases written before rollups existed need a one-off backfill
+        session = self.Session()
+        try:
+            has_rollups = session.query(AISRollup.id).first() is not None
+            has_messages = (
+                session.query(AISMessage.id).filter(AISMessage.is_valid == True).first()
+                is not None
+            )
+        finally:
+            session.close()
+        if has_messages and not has_rollups:
+            self.rebuild_rollups()
+
     def generate_unique_mmsi(self):
         """Generate a unique 9-digit MMSI."""
         session = self.Session()
@@ -76,7 +201,8 @@ class DatabaseManager:
         """Ingest and validate AIS message."""
         session = self.Session()
         try:
-            decoded = decode(message["payload"]).asdict()
+            with stage_timer("decode"):
+                decoded = decode(message["payload"]).asdict()
             mmsi = str(decoded["mmsi"])
             lat = decoded["lat"]
             lon = decoded["lon"]
@@ -85,19 +211,20 @@ class DatabaseManager:
             status = decoded["status"]
 
             if isinstance(message["timestamp"], str):
-                timestamp = datetime.fromisoformat(message["timestamp"])
-
-            is_valid = True
-            error_message = ""
-            if not (-90 <= lat <= 90):
-                is_valid = False
-                error_message += "Invalid latitude; "
-            if not (-180 <= lon <= 180):
-                is_valid = False
-                error_message += "Invalid longitude; "
-            if not (0 <= speed <= 102.2):
-                is_valid = False
-                error_message += "Invalid speed; "
+                timestamp = _parse_time(message["timestamp"])
+
+            with stage_timer("validation"):
+                is_valid = True
+                error_message = ""
+                if not (-90 <= lat <= 90):
+                    is_valid = False
+                    error_message += "Invalid latitude; "
+                if not (-180 <= lon <= 180):
+                    is_valid = False
+                    error_message += "Invalid longitude; "
+                if not (0 <= speed <= 102.2):
+                    is_valid = False
+                    error_message += "Invalid speed; "
 
             ais_message = AISMessage(
                 mmsi=mmsi,
@@ -111,9 +238,16 @@ class DatabaseManager:
                 is_valid=is_valid,
                 error_message=error_message,
             )
-            session.add(ais_message)
-            session.commit()
+            if is_valid:
+                with stage_timer("rollup"):
+                    self._update_rollups(session, mmsi, timestamp, lat, lon, speed)
+            with stage_timer("commit"):
+                session.add(ais_message)
+                session.commit()
+            if not is_valid:
+                INVALID_ROWS.inc()
         except Exception as e:
+            session.rollback()
             session.add(
                 AISMessage(
                     mmsi=message.get("mmsi"),
@@ -124,57 +258,385 @@ class DatabaseManager:
                 )
             )
             session.commit()
+            INVALID_ROWS.inc()
         finally:
             session.close()
 
-    def get_vessel_track(self, mmsi):
-        """Retrieve vessel's trajectory."""
+    def _update_rollups(self, session, mmsi, timestamp, lat, lon, speed):
+        """Fold a valid position into its hourly and daily rollup buckets.
+
+        Points before or after a bucket's stored endpoints splice against those
+        endpoints. Only a point landing strictly inside a bucket needs its raw
+        neighbours, which are looked up once and shared across resolutions.
+        """
+        neighbours = None
+
+        # Buckets at different resolutions never read each other's pending rows
+        with session.no_autoflush:
+            for resolution in ROLLUP_RESOLUTIONS:
+                bucket_start = _floor_time(timestamp, resolution)
+                rollup = (
+                    session.query(AISRollup)
+                    .filter_by(
+                        mmsi=mmsi, resolution=resolution, bucket_start=bucket_start
+                    )
+                    .first()
+                )
+                if rollup is None:
+                    session.add(
+                        AISRollup(
+                            mmsi=mmsi,
+                            resolution=resolution,
+                            bucket_start=bucket_start,
+                            first_timestamp=timestamp,
+                            first_latitude=lat,
+                            first_longitude=lon,
+                            last_timestamp=timestamp,
+                            last_latitude=lat,
+                            last_longitude=lon,
+                            distance=0.0,
+                            speed_sum=speed,
+                            speed_min=speed,
+                            speed_max=speed,
+                            point_count=1,
+                        )
+                    )
+                    continue
+
+                if timestamp > rollup.last_timestamp:
+                    prev = TrackPoint(
+                        rollup.last_timestamp,
+                        rollup.last_latitude,
+                        rollup.last_longitude,
+                    )
+                    nxt = None
+                elif timestamp < rollup.first_timestamp:
+                    prev = None
+                    nxt = TrackPoint(
+                        rollup.first_timestamp,
+                        rollup.first_latitude,
+                        rollup.first_longitude,
+                    )
+                else:
+                    if neighbours is None:
+                        neighbours = self._neighbours(session, mmsi, timestamp)
+                    prev, nxt = neighbours
+
+                if prev:
+                    rollup.distance += RouteGenerator.haversine_distance(
+                        prev.latitude, prev.longitude, lat, lon
+                    )
+                else:
+                    rollup.first_timestamp = timestamp
+                    rollup.first_latitude = lat
+                    rollup.first_longitude = lon
+                if nxt:
+                    rollup.distance += RouteGenerator.haversine_distance(
+                        lat, lon, nxt.latitude, nxt.longitude
+                    )
+                else:
+                    rollup.last_timestamp = timestamp
+                    rollup.last_latitude = lat
+                    rollup.last_longitude = lon
+                if prev and nxt:
+                    rollup.distance -= RouteGenerator.haversine_distance(
+                        prev.latitude, prev.longitude, nxt.latitude, nxt.longitude
+                    )
+                rollup.speed_sum += speed
+                rollup.speed_min = min(rollup.speed_min, speed)
+                rollup.speed_max = max(rollup.speed_max, speed)
+                rollup.point_count += 1
+
+    def _neighbours(self, session, mmsi, timestamp):
+        """Return the valid raw points immediately before and after timestamp."""
+        query = session.query(
+            AISMessage.timestamp, AISMessage.latitude, AISMessage.longitude
+        ).filter(AISMessage.mmsi == mmsi, AISMessage.is_valid == True)
+        before = (
+            query.filter(AISMessage.timestamp < timestamp)
+            .order_by(AISMessage.timestamp.desc())
+            .first()
+        )
+        after = (
+            query.filter(AISMessage.timestamp > timestamp)
+            .order_by(AISMessage.timestamp)
+            .first()
+        )
+        return before, after
+
+    def rebuild_rollups(self):
+        """Recompute every rollup bucket from the raw valid messages."""
         session = self.Session()
         try:
-            track = (
+            session.query(AISRollup).delete()
+            rows = (
                 session.query(
-                    AISMessage.timestamp, AISMessage.latitude, AISMessage.longitude
+                    AISMessage.mmsi,
+                    AISMessage.timestamp,
+                    AISMessage.latitude,
+                    AISMessage.longitude,
+                    AISMessage.speed,
                 )
-                .filter(AISMessage.mmsi == mmsi, AISMessage.is_valid == True)
-                .order_by(AISMessage.timestamp)
-                .all()
+                .filter(AISMessage.is_valid == True)
+                .order_by(AISMessage.mmsi, AISMessage.timestamp)
+                .yield_per(10000)
             )
-            return track
+            current = {}
+            rollups = []
+            for mmsi, timestamp, lat, lon, speed in rows:
+                for resolution in ROLLUP_RESOLUTIONS:
+                    bucket_start = _floor_time(timestamp, resolution)
+                    rollup = current.get(resolution)
+                    if (
+                        rollup is None
+                        or rollup.mmsi != mmsi
+                        or rollup.bucket_start != bucket_start
+                    ):
+                        rollup = AISRollup(
+                            mmsi=mmsi,
+                            resolution=resolution,
+                            bucket_start=bucket_start,
+                            first_timestamp=timestamp,
+                            first_latitude=lat,
+                            first_longitude=lon,
+                            distance=0.0,
+                            speed_sum=0.0,
+                            speed_min=speed,
+                            speed_max=speed,
+                            point_count=0,
+                        )
+                        current[resolution] = rollup
+                        rollups.append(rollup)
+                    else:
+                        rollup.distance += RouteGenerator.haversine_distance(
+                            rollup.last_latitude, rollup.last_longitude, lat, lon
+                        )
+                    rollup.last_timestamp = timestamp
+                    rollup.last_latitude = lat
+                    rollup.last_longitude = lon
+                    rollup.speed_sum += speed
+                    rollup.speed_min = min(rollup.speed_min, speed)
+                    rollup.speed_max = max(rollup.speed_max, speed)
+                    rollup.point_count += 1
+            session.add_all(rollups)
+            session.commit()
+        finally:
+            session.close()
+
+    def _raw_filter(self, query, mmsi, start, end):
+        """Restrict a query to valid raw messages for mmsi in [start, end)."""
+        return query.filter(
+            AISMessage.mmsi == mmsi,
+            AISMessage.is_valid == True,
+            AISMessage.timestamp >= start,
+            AISMessage.timestamp < end,
+        )
+
+    def _rollup_filter(self, query, mmsi, resolution, start, end):
+        """Restrict a query to rollup buckets for mmsi starting in [start, end)."""
+        return query.filter(
+            AISRollup.mmsi == mmsi,
+            AISRollup.resolution == resolution,
+            AISRollup.bucket_start >= start,
+            AISRollup.bucket_start < end,
+        )
+
+    def _count_track_points(self, session, mmsi, pieces, raw_positions=False):
+        """Count the points a track plan returns, or the raw positions it covers."""
+        total = 0
+        for resolution, piece_start, piece_end in pieces:
+            if resolution is None:
+                query = session.query(func.count(AISMessage.id))
+                query = self._raw_filter(query, mmsi, piece_start, piece_end)
+            else:
+                column = (
+                    func.sum(AISRollup.point_count)
+                    if raw_positions
+                    else func.count(AISRollup.id)
+                )
+                query = self._rollup_filter(
+                    session.query(column), mmsi, resolution, piece_start, piece_end
+                )
+            total += query.scalar() or 0
+        if not raw_positions and pieces and pieces[-1][0] is not None:
+            total += 1  # the final bucket also contributes its last position
+        return total
+
+    def _choose_track_resolution(self, session, mmsi, start, end, max_points):
+        """Pick the finest resolution whose point count fits within max_points.
+
+        Falls back to the coarsest rollup, which get_vessel_track then thins.
+        """
+        pieces = _plan_window(start, end)
+        if self._count_track_points(session, mmsi, pieces, raw_positions=True) <= (
+            max_points
+        ):
+            return None
+        for resolution in reversed(ROLLUP_RESOLUTIONS):
+            pieces = _track_plan(start, end, resolution)
+            if self._count_track_points(session, mmsi, pieces) <= max_points:
+                return resolution
+        return ROLLUP_RESOLUTIONS[0]
+
+    def get_vessel_track(
+        self, mmsi, start_time="2000-01-01", end_time="2100-01-01", max_points=None
+    ):
+        """Retrieve vessel's trajectory within the inclusive time window.
+
+        With max_points, whole buckets inside the window are read from the
+        finest rollup that fits the budget, the ragged edges from raw rows, and
+        the result is thinned evenly if it still exceeds max_points.
+        """
+        start = _parse_time(start_time)
+        end = _parse_time(end_time) + timedelta(microseconds=1)
+        session = self.Session()
+        try:
+            resolution = None
+            if max_points is not None:
+                resolution = self._choose_track_resolution(
+                    session, mmsi, start, end, max_points
+                )
+            QUERY_PLANS.inc(query="track", resolution=str(resolution or "raw"))
+
+            if resolution is None:
+                query = session.query(
+                    AISMessage.timestamp, AISMessage.latitude, AISMessage.longitude
+                )
+                track = (
+                    self._raw_filter(query, mmsi, start, end)
+                    .order_by(AISMessage.timestamp)
+                    .all()
+                )
+                return track
+
+            track = []
+            last = None
+            for piece_resolution, piece_start, piece_end in _track_plan(
+                start, end, resolution
+            ):
+                if piece_resolution is None:
+                    query = session.query(
+                        AISMessage.timestamp, AISMessage.latitude, AISMessage.longitude
+                    )
+                    rows = (
+                        self._raw_filter(query, mmsi, piece_start, piece_end)
+                        .order_by(AISMessage.timestamp)
+                        .all()
+                    )
+                    if rows:
+                        track.extend(TrackPoint(*row) for row in rows)
+                        last = None
+                    continue
+                rollups = (
+                    self._rollup_filter(
+                        session.query(AISRollup),
+                        mmsi,
+                        piece_resolution,
+                        piece_start,
+                        piece_end,
+                    )
+                    .order_by(AISRollup.bucket_start)
+                    .all()
+                )
+                if rollups:
+                    track.extend(
+                        TrackPoint(
+                            r.first_timestamp, r.first_latitude, r.first_longitude
+                        )
+                        for r in rollups
+                    )
+                    r = rollups[-1]
+                    last = TrackPoint(
+                        r.last_timestamp, r.last_latitude, r.last_longitude
+                    )
+            if last is not None and last.timestamp != track[-1].timestamp:
+                track.append(last)
+            return _thin_track(track, max_points)
         finally:
             session.close()
 
+    def _raw_segment(self, session, mmsi, start, end):
+        """Summarise raw valid messages in [start, end) as a single segment."""
+        query = session.query(
+            AISMessage.latitude, AISMessage.longitude, AISMessage.speed
+        )
+        rows = (
+            self._raw_filter(query, mmsi, start, end)
+            .order_by(AISMessage.timestamp)
+            .all()
+        )
+        if not rows:
+            return None
+
+        distance = 0
+        for i in range(1, len(rows)):
+            lat1, lon1 = rows[i - 1][0], rows[i - 1][1]
+            lat2, lon2 = rows[i][0], rows[i][1]
+            distance += RouteGenerator.haversine_distance(lat1, lon1, lat2, lon2)
+        return Segment(
+            rows[0][0],
+            rows[0][1],
+            rows[-1][0],
+            rows[-1][1],
+            distance,
+            sum(row[2] for row in rows),
+            len(rows),
+        )
+
     def calculate_vessel_stats(self, mmsi, start_time, end_time):
-        """Calculate distance and average speed within time window."""
+        """Calculate distance and average speed within time window.
+
+        The inclusive window is planned into rollup buckets plus raw edges, so
+        wide windows read one row per day instead of one per message.
+        """
+        start = _parse_time(start_time)
+        end = _parse_time(end_time) + timedelta(microseconds=1)
         session = self.Session()
         try:
-            rows = (
-                session.query(
-                    AISMessage.timestamp,
-                    AISMessage.latitude,
-                    AISMessage.longitude,
-                    AISMessage.speed,
+            segments = []
+            for resolution, piece_start, piece_end in _plan_window(start, end):
+                QUERY_PLANS.inc(query="stats", resolution=str(resolution or "raw"))
+                if resolution is None:
+                    segment = self._raw_segment(session, mmsi, piece_start, piece_end)
+                    if segment:
+                        segments.append(segment)
+                    continue
+                query = session.query(
+                    AISRollup.first_latitude,
+                    AISRollup.first_longitude,
+                    AISRollup.last_latitude,
+                    AISRollup.last_longitude,
+                    AISRollup.distance,
+                    AISRollup.speed_sum,
+                    AISRollup.point_count,
                 )
-                .filter(
-                    AISMessage.mmsi == mmsi,
-                    AISMessage.is_valid == True,
-                    AISMessage.timestamp.between(start_time, end_time),
+                segments.extend(
+                    self._rollup_filter(query, mmsi, resolution, piece_start, piece_end)
+                    .order_by(AISRollup.bucket_start)
+                    .all()
                 )
-                .order_by(AISMessage.timestamp)
-                .all()
-            )
 
-            if not rows:
+            if not segments:
                 return {"distance": 0, "avg_speed": 0}
 
             total_distance = 0
-            for i in range(1, len(rows)):
-                lat1, lon1 = rows[i - 1][1], rows[i - 1][2]
-                lat2, lon2 = rows[i][1], rows[i][2]
-                total_distance += RouteGenerator.haversine_distance(
-                    lat1, lon1, lat2, lon2
-                )
+            speed_sum = 0
+            point_count = 0
+            previous = None
+            for segment in segments:
+                if previous is not None:
+                    total_distance += RouteGenerator.haversine_distance(
+                        previous.last_latitude,
+                        previous.last_longitude,
+                        segment.first_latitude,
+                        segment.first_longitude,
+                    )
+                total_distance += segment.distance
+                speed_sum += segment.speed_sum
+                point_count += segment.point_count
+                previous = segment
 
-            avg_speed = np.mean([row[3] for row in rows]) if rows else 0
+            avg_speed = speed_sum / point_count
             return {"distance": total_distance, "avg_speed": avg_speed}
         finally:
             session.close()
@@ -187,7 +649,7 @@ class DatabaseManager:
             vessel_data = []
             for (mmsi,) in vessels:
                 stats = self.calculate_vessel_stats(mmsi, "2000-01-01", "2100-01-01")
-                track = self.get_vessel_track(mmsi)
+                track = self.get_vessel_track(mmsi, max_points=DEFAULT_TRACK_POINTS)
                 vessel_data.append(
                     {
                         "mmsi": mmsi,
@@ -0,0 +1,225 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+
+def _label_key(labels):
+    """Normalise keyword labels into a hashable, ordered key."""
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    """Render a label key as a Prometheus label set."""
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+class Counter:
+    """Monotonically increasing counter, optionally split by labels."""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter for the given label set."""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the current value for the given label set."""
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        """Render the counter in Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram of observed values, optionally split by labels."""
+
+    DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record a single observation for the given label set."""
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        """Return the number of observations for the given label set."""
+        entry = self._values.get(_label_key(labels))
+        return entry[2] if entry else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the enclosed block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        """Render the histogram in Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, (counts, total, observations) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_key = key + (("le", str(float(bound))),)
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(bucket_key)} {cumulative}"
+                    )
+                inf_key = key + (("le", "+Inf"),)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(inf_key)} {observations}"
+                )
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {observations}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics exposed together on the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation):
+        """Create and register a counter."""
+        metric = Counter(name, documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=Histogram.DEFAULT_BUCKETS):
+        """Create and register a histogram."""
+        metric = Histogram(name, documentation, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render every registered metric in Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "ais_stage_duration_seconds",
+    "Time spent in each simulation pipeline stage.",
+)
+MESSAGES_SENT = registry.counter(
+    "ais_messages_sent_total", "AIS messages streamed over WebSocket."
+)
+MESSAGES_RECEIVED = registry.counter(
+    "ais_messages_received_total", "AIS messages received over WebSocket."
+)
+INVALID_ROWS = registry.counter(
+    "ais_invalid_rows_total", "AIS rows stored with is_valid set to false."
+)
+ENCODE_FAILURES = registry.counter(
+    "ais_encode_failures_total", "Positions that could not be encoded as AIS."
+)
+RECEIVE_ERRORS = registry.counter(
+    "ais_receive_errors_total", "Errors raised while receiving AIS messages."
+)
+QUERY_PLANS = registry.counter(
+    "ais_query_plans_total", "Query pieces served per resolution (raw or rollup)."
+)
+
+
+def stage_timer(stage):
+    """Time a pipeline stage into the shared stage duration histogram."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+class SamplingProfiler:
+    """Samples thread stacks periodically and writes folded flamegraph input.
+
+    The output uses the collapsed stack format ("frame;frame;frame count"),
+    which flamegraph.pl, inferno and speedscope read directly.
+    """
+
+    def __init__(self, output_file, interval_seconds=0.005):
+        self.output_file = output_file
+        self.interval_seconds = interval_seconds
+        self.samples = Tally()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        """Record the current stack of every thread except the sampler."""
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._sample()
+
+    def start(self):
+        """Start sampling in a background daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the collected stacks to the output file."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with open(self.output_file, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -3,6 +3,7 @@ from math import radians, sin, cos, sqrt, atan2
 import searoute as sr
 from datetime import datetime, timedelta
 import random
+from src.metrics import stage_timer
 
 
 class RouteGenerator:
@@ -51,15 +52,21 @@ class RouteGenerator:
     def generate_route(self, origin, destination):
         """Generate route using searoute-py."""
         try:
-            route = sr.searoute(
-                [origin["lon"], origin["lat"]], [destination["lon"], destination["lat"]]
-            )
+            with stage_timer("route_generation"):
+                route = sr.searoute(
+                    [origin["lon"], origin["lat"]],
+                    [destination["lon"], destination["lat"]],
+                )
             return route.geometry.coordinates
         except Exception as e:
             raise RuntimeError(f"Failed to generate route: {e}")
 
     def interpolate_positions(self, waypoints):
         """Interpolate positions along the route at fixed intervals."""
+        with stage_timer("interpolation"):
+            return self._interpolate_positions(waypoints)
+
+    def _interpolate_positions(self, waypoints):
         positions = []
         total_distance = 0
         distances = []
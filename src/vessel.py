@@ -1,4 +1,8 @@
+import logging
 from pyais.encode import encode_dict
+from src.metrics import ENCODE_FAILURES, stage_timer
+
+logger = logging.getLogger(__name__)
 
 
 class Vessel:
@@ -22,7 +26,8 @@ class Vessel:
                 "status": 0,
             }
             try:
-                encoded = encode_dict(ais_data)
+                with stage_timer("encode"):
+                    encoded = encode_dict(ais_data)
                 messages.append(
                     {
                         "message": "AIVDM",
@@ -31,6 +36,7 @@ class Vessel:
                         "payload": encoded[0],
                     }
                 )
-            except Exception as e:
-                print(f"Failed to encode AIS message: {e}")
+            except Exception:
+                ENCODE_FAILURES.inc()
+                logger.exception("Failed to encode AIS message")
         return messages
@@ -1,7 +1,16 @@
 import asyncio
 import json
+import logging
 import websockets
 from datetime import datetime
+from src.metrics import (
+    MESSAGES_RECEIVED,
+    MESSAGES_SENT,
+    RECEIVE_ERRORS,
+    stage_timer,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class WebSocketStreamer:
@@ -12,6 +21,12 @@ class WebSocketStreamer:
         self.speed_factor = speed_factor
         self.server = None  # will hold server instance
 
+    async def _send(self, websocket, msg):
+        """Send a single AIS message and record it."""
+        with stage_timer("send"):
+            await websocket.send(json.dumps(msg))
+        MESSAGES_SENT.inc()
+
     async def stream_messages(self, websocket, messages):
         """Stream AIS messages over WebSocket."""
 
@@ -24,12 +39,12 @@ class WebSocketStreamer:
         try:
             if self.speed_factor == -1:
                 for msg in messages:
-                    await websocket.send(json.dumps(msg))
+                    await self._send(websocket, msg)
                 await websocket.send("__END__")  # signal end of stream
             else:
                 interval = 5 * 60 / self.speed_factor
                 for msg in messages:
-                    await websocket.send(json.dumps(msg))
+                    await self._send(websocket, msg)
                     await asyncio.sleep(interval)
                 await websocket.send("__END__")
         except websockets.exceptions.ConnectionClosed:
@@ -44,9 +59,11 @@ class WebSocketStreamer:
                     if message == "__END__":
                         print("All messages received. Exiting.")
                         break
+                    MESSAGES_RECEIVED.inc()
                     db_manager.ingest_message(json.loads(message))
-        except Exception as e:
-            print(f"Error in receiving: {e}")
+        except Exception:
+            RECEIVE_ERRORS.inc()
+            logger.exception("Error in receiving")
 
     async def run(self, messages, db_manager):
         """Run WebSocket server and client, then exit."""
@@ -1,10 +1,15 @@
 import pytest
-from src.database import DatabaseManager, AISMessage
+from src.database import DatabaseManager, AISMessage, AISRollup, DAY, HOUR, _plan_window
+from src.route_generator import RouteGenerator
 from src.dashboard import create_app
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from datetime import datetime, timedelta
 from pyais import encode_msg
+from pyais.encode import encode_dict
+from src.metrics import Histogram, INVALID_ROWS, STAGE_SECONDS, SamplingProfiler
 import json
+import random
+import time
 
 # Fixture to create an in-memory database
 @pytest.fixture
@@ -134,3 +139,199 @@ def test_ingest_malformed_payload(db_manager):
     session = db_manager.Session()
     result = session.query(AISMessage).first()
     session.close
+
+# Tests for the metrics layer
+def _encoded_message(mmsi, lat, lon, speed, timestamp):
+    payload = encode_dict(
+        {'mmsi': mmsi, 'lat': lat, 'lon': lon, 'msg_type': 1,
+         'speed': speed, 'course': 0, 'status': 0}
+    )[0]
+    return {'message': 'AIVDM', 'mmsi': str(mmsi), 'timestamp': timestamp, 'payload': payload}
+
+def test_histogram_render_is_cumulative():
+    """Test that histogram buckets are cumulative in Prometheus output."""
+    histogram = Histogram('test_seconds', 'Test histogram.', buckets=(0.1, 1))
+    histogram.observe(0.05, stage='a')
+    histogram.observe(0.5, stage='a')
+    histogram.observe(5, stage='a')
+    lines = histogram.render()
+
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+
+def test_ingest_records_metrics(db_manager):
+    """Test that ingestion records stage timings and invalid rows."""
+    invalid_before = INVALID_ROWS.value()
+    commits_before = STAGE_SECONDS.count(stage='commit')
+
+    db_manager.ingest_message(_encoded_message(123456789, 51.9225, 4.4792, 10.0, '2025-01-01T00:00:00'))
+    db_manager.ingest_message(_encoded_message(123456789, 91.0, 4.4792, 10.0, '2025-01-01T00:05:00'))
+
+    assert STAGE_SECONDS.count(stage='commit') == commits_before + 2
+    assert INVALID_ROWS.value() == invalid_before + 1
+
+def test_invalid_rows_counts_only_stored_rows(db_manager):
+    """Test that failed fallback inserts do not count as stored invalid rows."""
+    message = _encoded_message(123456789, 51.9225, 4.4792, 10.0, '2025-01-01T00:00:00')
+    db_manager.ingest_message(message)
+    invalid_before = INVALID_ROWS.value()
+
+    # The duplicate's fallback row cannot be stored with a string timestamp
+    with pytest.raises(Exception):
+        db_manager.ingest_message(message)
+    assert INVALID_ROWS.value() == invalid_before
+
+    db_manager.ingest_message(
+        {'mmsi': '123456789', 'timestamp': datetime(2025, 1, 1, 0, 5), 'payload': 'invalid_payload'}
+    )
+    assert INVALID_ROWS.value() == invalid_before + 1
+
+def test_metrics_endpoint(client, db_manager):
+    """Test the /metrics endpoint serves Prometheus text format."""
+    db_manager.ingest_message(_encoded_message(123456789, 51.9225, 4.4792, 10.0, '2025-01-01T00:00:00'))
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert '# TYPE ais_stage_duration_seconds histogram' in body
+    assert 'ais_stage_duration_seconds_count{stage="decode"}' in body
+    assert '# TYPE ais_invalid_rows_total counter' in body
+
+def test_sampling_profiler_writes_folded_stacks(tmp_path):
+    """Test that the profiler writes collapsed stacks for flamegraph tools."""
+    output = tmp_path / 'profile.folded'
+    with SamplingProfiler(str(output), interval_seconds=0.001):
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+
+    lines = output.read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert 'test_sampling_profiler_writes_folded_stacks' in stack
+
+# Tests for rollup downsampling
+def _ingest_voyage(db_manager, mmsi=123456789, hours=72, step_minutes=30, order=None):
+    """Ingest a synthetic voyage newest-first, as the WebSocket streamer does."""
+    start = datetime(2025, 1, 1, 0, 10)
+    messages = []
+    for i in range(hours * 60 // step_minutes):
+        timestamp = start + timedelta(minutes=i * step_minutes)
+        messages.append(
+            _encoded_message(mmsi, 50.0 + i * 0.01, 4.0 + i * 0.02, 8.0 + i % 5, timestamp.isoformat())
+        )
+    if order is None:
+        messages.reverse()
+    else:
+        order(messages)
+    for message in messages:
+        db_manager.ingest_message(message)
+
+def _raw_stats(db_manager, mmsi, start, end):
+    session = db_manager.Session()
+    rows = (
+        session.query(AISMessage.latitude, AISMessage.longitude, AISMessage.speed)
+        .filter(AISMessage.mmsi == mmsi, AISMessage.is_valid == True,
+                AISMessage.timestamp.between(datetime.fromisoformat(start), datetime.fromisoformat(end)))
+        .order_by(AISMessage.timestamp)
+        .all()
+    )
+    session.close()
+    distance = sum(
+        RouteGenerator.haversine_distance(a[0], a[1], b[0], b[1]) for a, b in zip(rows, rows[1:])
+    )
+    return distance, sum(r[2] for r in rows) / len(rows)
+
+def test_plan_window_uses_coarsest_buckets():
+    """Test that the planner covers whole days with daily rollups and edges finer."""
+    plan = _plan_window(datetime(2025, 1, 1, 0, 30), datetime(2025, 1, 4, 2, 0))
+
+    assert plan == [
+        (None, datetime(2025, 1, 1, 0, 30), datetime(2025, 1, 1, 1, 0)),
+        (HOUR, datetime(2025, 1, 1, 1, 0), datetime(2025, 1, 2)),
+        (DAY, datetime(2025, 1, 2), datetime(2025, 1, 4)),
+        (HOUR, datetime(2025, 1, 4), datetime(2025, 1, 4, 2, 0)),
+    ]
+
+def test_rollup_stats_match_raw(db_manager):
+    """Test that rollup-planned stats equal a scan over raw rows."""
+    _ingest_voyage(db_manager)
+
+    for start, end in [
+        ('2000-01-01', '2100-01-01'),
+        ('2025-01-01T05:45:00', '2025-01-03T13:10:00'),
+        ('2025-01-02T00:00:00', '2025-01-02T00:30:00'),
+    ]:
+        stats = db_manager.calculate_vessel_stats('123456789', start, end)
+        distance, avg_speed = _raw_stats(db_manager, '123456789', start, end)
+        assert stats['distance'] == pytest.approx(distance)
+        assert stats['avg_speed'] == pytest.approx(avg_speed)
+
+@pytest.mark.parametrize('order', [None, random.Random(7).shuffle])
+def test_rebuild_rollups_matches_incremental(db_manager, order):
+    """Test that a full rebuild reproduces the incrementally maintained rollups."""
+    _ingest_voyage(db_manager, order=order)
+
+    def snapshot():
+        session = db_manager.Session()
+        rows = [
+            (r.resolution, r.bucket_start, r.first_timestamp, r.last_timestamp,
+             round(r.distance, 9), r.speed_sum, r.point_count)
+            for r in session.query(AISRollup).order_by(AISRollup.resolution, AISRollup.bucket_start)
+        ]
+        session.close()
+        return rows
+
+    incremental = snapshot()
+    db_manager.rebuild_rollups()
+
+    assert len([r for r in incremental if r[0] == DAY]) == 3
+    assert snapshot() == incremental
+
+def test_track_downsampled_to_point_budget(db_manager):
+    """Test that tracks never exceed the point budget and keep their endpoints."""
+    _ingest_voyage(db_manager)
+    raw = db_manager.get_vessel_track('123456789')
+
+    assert len(raw) == 144
+    for max_points in (200, 144, 100, 73, 72, 10, 4, 3, 2):
+        track = db_manager.get_vessel_track('123456789', max_points=max_points)
+        assert len(track) <= max_points
+        assert track[-1].timestamp == raw[-1].timestamp
+        if max_points > 1:
+            assert track[0].timestamp == raw[0].timestamp
+        assert [p.timestamp for p in track] == sorted(p.timestamp for p in track)
+
+def test_track_downsampled_stays_inside_window(db_manager):
+    """Test that rollup-served tracks only return points inside the window."""
+    _ingest_voyage(db_manager)
+    start, end = datetime(2025, 1, 1, 5, 45), datetime(2025, 1, 3, 13, 10)
+
+    for max_points in (60, 10, 1):
+        track = db_manager.get_vessel_track(
+            '123456789', start.isoformat(), end.isoformat(), max_points=max_points
+        )
+        assert 0 < len(track) <= max_points
+        assert all(start <= p.timestamp <= end for p in track)
+
+    track = db_manager.get_vessel_track(
+        '123456789', '2025-01-02T12:00:00', '2025-01-02T13:00:00', max_points=1
+    )
+    assert [p.timestamp for p in track] == [datetime(2025, 1, 2, 12, 40)]
+
+def test_stats_accept_timezone_offsets(client, db_manager):
+    """Test that aware window bounds are normalised to UTC."""
+    _ingest_voyage(db_manager)
+    naive = client.get(
+        '/api/vessel/123456789/stats?start_time=2025-01-01T05:45:00&end_time=2025-01-02T13:10:00'
+    ).get_json()
+    aware = client.get(
+        '/api/vessel/123456789/stats?start_time=2025-01-01T05:45:00Z&end_time=2025-01-02T15:10:00%2B02:00'
+    ).get_json()
+
+    assert aware['distance'] == pytest.approx(naive['distance'])
+    assert aware['avg_speed'] == pytest.approx(naive['avg_speed'])